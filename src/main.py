@@ -1,26 +1,70 @@
+import atexit
+import functools
 import json
 import os
 import re
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-import random
+from datetime import datetime
 # import math # Non più usato direttamente, rimosso per pulizia
 import sqlite3
+import sys
 from thefuzz import fuzz # Import per il calcolo della similarità fuzzy
 
+# orjson (parser C, opzionale) accelera parse/dump della knowledge base; in sua
+# assenza si ricade sullo stdlib json senza cambiare comportamento.
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+def _json_loads(text: str):
+    if _orjson is not None:
+        return _orjson.loads(text)
+    return json.loads(text)
+
+def _json_dumps_pretty(obj) -> str:
+    if _orjson is not None:
+        return _orjson.dumps(obj, option=_orjson.OPT_INDENT_2 | _orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, indent=4, ensure_ascii=False)
+
 KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge_base.json')
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'ccu_data.db')
 
+# Pattern regex precompilati a livello di modulo: evitano il lookup (con lock)
+# nella cache interna di re ad ogni chiamata delle funzioni di normalizzazione.
+_RE_NONWORD_KEEP_APOSTROPHE = re.compile(r"[^\w\s'-]")
+_RE_NONWORD = re.compile(r'[^\w\s-]')
+_RE_WHITESPACE = re.compile(r'\s+')
+
+# Cache dei caricamenti riusciti della KB, per percorso assoluto -> (mtime_ns,
+# entries). Se il file non e' cambiato si evita di rileggere e ri-decodificare
+# il JSON (rilevante quando il processo viene rilanciato comando per comando).
+_KB_CACHE: dict[str, tuple[int, list[dict]]] = {}
+
 def load_knowledge_base(filepath: str) -> list[dict]:
     """
     Carica la base di conoscenza da un file JSON.
     La nuova struttura prevede un array di "entries" direttamente.
+    I caricamenti riusciti sono memoizzati sull'mtime del file: richiamare la
+    funzione con un file invariato restituisce le entries già in memoria.
     """
+    cache_key = os.path.abspath(filepath)
+    try:
+        mtime_ns = os.stat(filepath).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    if mtime_ns is not None:
+        cached = _KB_CACHE.get(cache_key)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+            data = _json_loads(f.read())
             # La base di conoscenza è ora un array di entries
             if isinstance(data, dict) and "entries" in data and isinstance(data["entries"], list):
+                if mtime_ns is not None:
+                    _KB_CACHE[cache_key] = (mtime_ns, data["entries"])
                 return data["entries"]
             else:
                 print(f"Errore: Il file della base di conoscenza in {filepath} non ha la struttura attesa con un array 'entries'.")
@@ -28,7 +72,7 @@ def load_knowledge_base(filepath: str) -> list[dict]:
     except FileNotFoundError:
         print(f"Errore: Il file della base di conoscenza non è stato trovato in {filepath}")
         return []
-    except json.JSONDecodeError:
+    except ValueError: # json.JSONDecodeError e orjson.JSONDecodeError derivano entrambi da ValueError
         print(f"Errore: Il file della base di conoscenza in {filepath} non è un JSON valido.")
         return []
 
@@ -40,49 +84,77 @@ def load_knowledge_base(filepath: str) -> list[dict]:
 #     text = text.strip('_')
 #     return text
 
+@functools.lru_cache(maxsize=4096)
 def normalize_text_for_search(text: str) -> str:
     """
     Normalizza il testo per la ricerca: lowercase e rimozione punteggiatura base.
+    Memoizzata: gli stessi testi (query ripetute, voci KB) vengono normalizzati
+    una volta sola per processo.
     """
     text = text.lower()
     # Rimuove la punteggiatura eccetto apostrofi e trattini che potrebbero essere in parole
-    text = re.sub(r'[^\w\s\'-]', '', text)
-    text = re.sub(r'\s+', ' ', text).strip() # Normalizza spazi multipli
+    text = _RE_NONWORD_KEEP_APOSTROPHE.sub('', text)
+    text = _RE_WHITESPACE.sub(' ', text).strip() # Normalizza spazi multipli
     return text
 
+# Congiunzioni che separano sotto-domande: singole parole e coppie di parole.
+# Una scansione manuale dei token e' piu' veloce del re.split con alternation
+# IGNORECASE usato in precedenza (il motore re riesamina la stringa per ogni
+# alternativa del pattern).
+_CONJUNCTIONS = frozenset({"e", "o", "oppure"})
+_CONJUNCTION_PAIRS = frozenset({("e", "poi"), ("e", "anche"), ("ed", "anche"), ("o", "anche")})
+
+def _split_sentences(text: str) -> list[str]:
+    """
+    Divide il testo in frasi terminate da '.', '?' o '!' con un'unica
+    scansione dei caratteri; equivale a _RE_SENTENCE_SPLIT.findall ma senza
+    passare dal motore regex (i terminatori consecutivi extra vengono ignorati).
+    """
+    sentences = []
+    start = None
+    for i, ch in enumerate(text):
+        if ch in '.?!':
+            if start is not None:
+                sentences.append(text[start:i + 1])
+                start = None
+        elif start is None:
+            start = i
+    if start is not None:
+        sentences.append(text[start:])
+    return sentences
+
 def decompose_question(original_user_input: str) -> list[str]:
     if not original_user_input:
         return []
-    sentences = re.findall(r'[^.?!]+(?:[.?!]|$)', original_user_input)
+    sentences = _split_sentences(original_user_input)
     if not sentences:
         sentences = [original_user_input]
     final_sub_questions = []
-    conjunction_pattern = r'\s+\b(e|o|oppure|e poi|e anche|ed anche|o anche)\b\s+'
     for sentence in sentences:
         sentence = sentence.strip()
         if not sentence:
             continue
-        parts = re.split(conjunction_pattern, sentence, flags=re.IGNORECASE)
-        current_sub_sentence = ""
-        if len(parts) > 1:
-            for part_idx, part_content in enumerate(parts):
-                is_conjunction = part_content.lower().strip() in ["e", "o", "oppure", "e poi", "e anche", "ed anche", "o anche"]
-                if not is_conjunction and part_content.strip():
-                    current_sub_sentence += part_content
-                    is_last_part = (part_idx == len(parts) - 1)
-                    next_part_is_conjunction_or_end = True
-                    if not is_last_part and (part_idx + 1 < len(parts)):
-                         next_part_is_conjunction_or_end = parts[part_idx+1].lower().strip() in ["e", "o", "oppure", "e poi", "e anche", "ed anche", "o anche"]
-                    if current_sub_sentence.strip() and (is_last_part or next_part_is_conjunction_or_end) :
-                        final_sub_questions.append(current_sub_sentence.strip())
-                        current_sub_sentence = ""
-                elif is_conjunction and current_sub_sentence.strip():
-                    final_sub_questions.append(current_sub_sentence.strip())
-                    current_sub_sentence = ""
-            if current_sub_sentence.strip():
-                final_sub_questions.append(current_sub_sentence.strip())
-        else:
-            final_sub_questions.append(sentence.strip())
+        tokens = sentence.split()
+        buf = []
+        i = 0
+        while i < len(tokens):
+            two = (tokens[i].lower(), tokens[i + 1].lower()) if i + 1 < len(tokens) else None
+            if two in _CONJUNCTION_PAIRS:
+                if buf:
+                    final_sub_questions.append(' '.join(buf))
+                    buf = []
+                i += 2
+                continue
+            if tokens[i].lower() in _CONJUNCTIONS:
+                if buf:
+                    final_sub_questions.append(' '.join(buf))
+                    buf = []
+                i += 1
+                continue
+            buf.append(tokens[i])
+            i += 1
+        if buf:
+            final_sub_questions.append(' '.join(buf))
     filtered_questions = [q.strip() for q in final_sub_questions if q.strip() and len(q.strip().split()) > 1]
     if not filtered_questions and original_user_input.strip():
         less_filtered = [q.strip() for q in final_sub_questions if q.strip()]
@@ -91,34 +163,89 @@ def decompose_question(original_user_input: str) -> list[str]:
         return [original_user_input.strip()]
     return filtered_questions if filtered_questions else [original_user_input.strip()]
 
+# Tabella per str.translate che elimina la punteggiatura ASCII non ammessa
+# nelle chiavi (tutto cio' che non e' alfanumerico, spazio, '-' o '_').
+_KEY_TRANS = str.maketrans({c: None for c in map(chr, range(128))
+                            if not (c.isalnum() or c.isspace() or c in '-_')})
+
+@functools.lru_cache(maxsize=4096)
 def normalize_key_for_storage(text: str) -> str:
     text = text.lower()
-    text = re.sub(r'[^\w\s-]', '', text)
-    text = re.sub(r'\s+', '_', text)
+    # Percorso rapido per input ASCII: str.translate fa una sola passata C.
+    # Gli input con caratteri non-ASCII (es. lettere accentate) ricadono sul
+    # regex, che conserva la semantica Unicode di \w.
+    if text.isascii():
+        text = text.translate(_KEY_TRANS)
+    else:
+        text = _RE_NONWORD.sub('', text)
+    text = _RE_WHITESPACE.sub('_', text)
     return text.strip('_')
 
-def add_knowledge(category: str, key: str, value: str, filepath: str = KNOWLEDGE_BASE_PATH) -> bool:
+def _additions_sidecar_path(filepath: str) -> str:
+    return filepath + '.additions.jsonl'
+
+def add_knowledge(category: str, key: str, value: str, filepath: str = KNOWLEDGE_BASE_PATH,
+                  current_kb: dict | None = None) -> bool:
+    """
+    Aggiunge una voce alla base di conoscenza. La persistenza avviene in
+    append su un file sidecar JSONL (una riga JSON per aggiunta): costo O(voce)
+    per inserimento invece della riscrittura dell'intero JSON. Le aggiunte
+    vengono consolidate nel file principale da compact_knowledge_additions().
+    Se il chiamante passa `current_kb` (lo stato gia' in memoria), la voce
+    viene applicata anche li', cosi' la sessione vede subito l'aggiornamento.
+    """
+    try:
+        normalized_key = normalize_key_for_storage(key)
+        if current_kb is not None:
+            current_kb.setdefault(category, {})[normalized_key] = value
+        line = json.dumps({'category': category, 'key': normalized_key, 'value': value},
+                          ensure_ascii=False)
+        with open(_additions_sidecar_path(filepath), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+        return True
+    except IOError as e:
+        print(f"Errore di I/O durante l'aggiunta di conoscenza: {e}")
+        return False
+    except Exception as e:
+        print(f"Errore imprevisto durante l'aggiunta di conoscenza: {e}")
+        return False
+
+def compact_knowledge_additions(filepath: str = KNOWLEDGE_BASE_PATH) -> bool:
+    """
+    Consolida il sidecar delle aggiunte nel file principale della base di
+    conoscenza (riscrittura atomica) e rimuove il sidecar. Pensata per essere
+    chiamata all'avvio o periodicamente, non ad ogni inserimento.
+    """
+    sidecar_path = _additions_sidecar_path(filepath)
+    if not os.path.exists(sidecar_path):
+        return True
     try:
         current_kb = {}
         if os.path.exists(filepath):
             with open(filepath, 'r', encoding='utf-8') as f:
                 try:
-                    current_kb = json.load(f)
-                except json.JSONDecodeError:
-                    print(f"Avviso: {filepath} contiene JSON non valido. Sarà sovrascritto se si aggiunge conoscenza.")
+                    current_kb = _json_loads(f.read())
+                except ValueError:
+                    print(f"Avviso: {filepath} contiene JSON non valido. Sarà sovrascritto dal consolidamento.")
                     current_kb = {}
-        normalized_key = normalize_key_for_storage(key)
-        if category not in current_kb:
-            current_kb[category] = {}
-        current_kb[category][normalized_key] = value
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(current_kb, f, indent=4, ensure_ascii=False)
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                addition = _json_loads(line)
+                current_kb.setdefault(addition['category'], {})[addition['key']] = addition['value']
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'w', encoding='utf-8') as f:
+            f.write(_json_dumps_pretty(current_kb))
+        os.replace(tmp_filepath, filepath)
+        os.remove(sidecar_path)
         return True
     except IOError as e:
-        print(f"Errore di I/O durante l'aggiunta di conoscenza: {e}")
+        print(f"Errore di I/O durante il consolidamento delle aggiunte: {e}")
         return False
     except Exception as e:
-        print(f"Errore imprevisto durante l'aggiunta di conoscenza: {e}")
+        print(f"Errore imprevisto durante il consolidamento delle aggiunte: {e}")
         return False
 
 def get_categories(knowledge_base: dict) -> list[str]:
@@ -139,9 +266,52 @@ def get_categories(knowledge_base: dict) -> list[str]:
             categories.update(cats)
         elif "category" in entry and isinstance(entry["category"], list): # Supporta anche liste di categorie
              categories.update(entry["category"])
-    return sorted(list(categories))
+    return sorted(categories)
 
 
+def build_kb_index(knowledge_base_entries: list[dict]) -> tuple[dict[str, list[int]], dict[str, dict], list[tuple[str, list[str]]], list[frozenset]]:
+    """
+    Costruisce in un'unica passata sulla KB tutte le strutture derivate,
+    immutabili per la vita della KB:
+      - indice invertito token -> indici delle entries (prefiltro candidati);
+      - mappa testo normalizzato -> entry per i match esatti O(1);
+      - testi normalizzati (domanda, varianti) per entry, per lo scoring fuzzy;
+      - frozenset dei token per entry, per i confronti di overlap.
+    """
+    index: dict[str, list[int]] = {}
+    exact_map: dict[str, dict] = {}
+    norm_texts: list[tuple[str, list[str]]] = []
+    token_sets: list[frozenset] = []
+    for idx, entry in enumerate(knowledge_base_entries):
+        norm_domanda = normalize_text_for_search(entry.get("domanda", ""))
+        norm_varianti = [normalize_text_for_search(v) for v in entry.get("varianti_domanda", [])]
+        norm_texts.append((norm_domanda, norm_varianti))
+        tokens = set(norm_domanda.split())
+        if norm_domanda:
+            exact_map.setdefault(norm_domanda, entry)
+        for norm_variante in norm_varianti:
+            tokens.update(norm_variante.split())
+            if norm_variante:
+                exact_map.setdefault(norm_variante, entry)
+        token_set = frozenset(tokens)
+        token_sets.append(token_set)
+        for token in token_set:
+            index.setdefault(token, []).append(idx)
+    return index, exact_map, norm_texts, token_sets
+
+# Cache delle strutture derivate dalla KB: la lista di entries resta la stessa
+# per tutta la sessione CLI, quindi vengono costruite una sola volta.
+_KB_INDEX_CACHE: dict[int, tuple] = {}
+
+def _get_kb_caches(knowledge_base_entries: list[dict]) -> tuple[dict[str, list[int]], dict[str, dict], list[tuple[str, list[str]]], list[frozenset]]:
+    cached = _KB_INDEX_CACHE.get(id(knowledge_base_entries))
+    if cached is not None and cached[0] is knowledge_base_entries:
+        return cached[1], cached[2], cached[3], cached[4]
+    index, exact_map, norm_texts, token_sets = build_kb_index(knowledge_base_entries)
+    _KB_INDEX_CACHE.clear()
+    _KB_INDEX_CACHE[id(knowledge_base_entries)] = (knowledge_base_entries, index, exact_map, norm_texts, token_sets)
+    return index, exact_map, norm_texts, token_sets
+
 def is_query_generic(normalized_query: str, common_generic_terms: set) -> bool:
     """
     Determina se una query è generica basandosi sulla lunghezza e sulla presenza di termini comuni.
@@ -156,189 +326,287 @@ def is_query_generic(normalized_query: str, common_generic_terms: set) -> bool:
         return True
     return False
 
+# Costanti del motore di ricerca, definite una sola volta a import time invece
+# che ricostruite ad ogni chiamata di find_answer_for_query.
+# Termini comuni che indicano una domanda generica (da espandere se necessario)
+COMMON_GENERIC_TERMS = {"cosa", "cos'è", "spiega", "spiegami", "dimmi", "che", "qual è", "come funziona", "definizione"}
+# Soglia minima di similarità testuale per considerare un match valido
+MIN_FUZZY_SCORE_THRESHOLD = 75 # Abbassato per permettere più match iniziali, poi filtrati da specificità
+HIGH_FUZZY_SCORE_FOR_SPECIFIC_OVERRIDE = 90 # Se il match testuale è molto alto, la specificità alta può vincere
+
+def _format_entry_response(entry: dict) -> str:
+    """Compone il testo di risposta per una entry, inclusi i followup suggeriti."""
+    response_text = entry.get("risposta", "Risposta non trovata per questa voce.")
+    followups = entry.get("followup_suggestions", [])
+    if followups:
+        response_text += "\n\nPotresti anche chiedermi:\n" + "\n".join([f"- {sugg}" for sugg in followups])
+    return response_text
+
+# Messaggio "Non so" migliorato
+_NO_ANSWER_MESSAGE = "Mi dispiace, non ho trovato una risposta precisa nella mia attuale base di conoscenza. Prova a riformulare la tua domanda o a chiedere qualcosa di più specifico."
+
 def find_answer_for_query(user_input: str, knowledge_base_entries: list[dict]) -> str | None:
     """
     Trova la risposta migliore per una data query utente utilizzando la nuova struttura della knowledge base.
     Considera 'domanda', 'varianti_domanda', 'level', e 'specificity_score'.
     """
-    if not knowledge_base_entries:
-        return None
-
-    normalized_user_input = normalize_text_for_search(user_input)
-    if not normalized_user_input.strip():
-        return None # Input utente vuoto o solo spazi
-
-    best_match_entry = None
-    highest_score = -1
-
-    # Termini comuni che indicano una domanda generica (da espandere se necessario)
-    COMMON_GENERIC_TERMS = {"cosa", "cos'è", "spiega", "spiegami", "dimmi", "che", "qual è", "come funziona", "definizione"}
-    query_is_potentially_generic = is_query_generic(normalized_user_input, COMMON_GENERIC_TERMS)
-
-    # Soglia minima di similarità testuale per considerare un match valido
-    MIN_FUZZY_SCORE_THRESHOLD = 75 # Abbassato per permettere più match iniziali, poi filtrati da specificità
-    HIGH_FUZZY_SCORE_FOR_SPECIFIC_OVERRIDE = 90 # Se il match testuale è molto alto, la specificità alta può vincere
+    return find_answers_for_queries([user_input], knowledge_base_entries)[0]
 
-    for entry in knowledge_base_entries:
-        current_text_match_score = 0
-
-        # 1. Calcolo del punteggio di similarità testuale (Fuzzy Matching)
-        # Controlla la domanda principale
-        q_text = normalize_text_for_search(entry.get("domanda", ""))
-        score_domanda = fuzz.WRatio(normalized_user_input, q_text) # WRatio gestisce bene differenze di lunghezza
-        current_text_match_score = score_domanda
-
-        # Controlla le varianti della domanda e prendi il punteggio massimo
-        for variante in entry.get("varianti_domanda", []):
-            v_text = normalize_text_for_search(variante)
-            score_variante = fuzz.WRatio(normalized_user_input, v_text)
-            if score_variante > current_text_match_score:
-                current_text_match_score = score_variante
-
-        # Se il punteggio di similarità testuale è troppo basso, scarta questa entry
-        if current_text_match_score < MIN_FUZZY_SCORE_THRESHOLD:
+def find_answers_for_queries(queries: list[str], knowledge_base_entries: list[dict]) -> list[str | None]:
+    """
+    Risolve più query (es. le sotto-domande di decompose_question) in un'unica
+    passata sulla KB, invece di una scansione completa per query. I match
+    esatti vengono risolti subito via hashmap; per le restanti query la
+    scansione condivide il fetch di entry e testi normalizzati, limitandosi
+    all'unione dei candidati dell'indice invertito. Restituisce una lista
+    allineata a `queries` (None per query vuote o KB vuota).
+    """
+    answers: list[str | None] = [None] * len(queries)
+    if not knowledge_base_entries:
+        return answers
+
+    kb_index, kb_exact_map, kb_norm_texts, _kb_token_sets = _get_kb_caches(knowledge_base_entries)
+
+    # Stato per le query non risolte dal match esatto. 'cands' a None indica
+    # che la query non condivide alcun token con la KB (es. soli errori di
+    # battitura) e richiede la scansione completa per non perdere match fuzzy.
+    pending: list[dict] = []
+    for query_idx, user_input in enumerate(queries):
+        normalized_user_input = normalize_text_for_search(user_input)
+        if not normalized_user_input.strip():
+            continue # Input utente vuoto o solo spazi
+
+        # Corrispondenza esatta con una domanda/variante: risposta immediata in
+        # O(1) senza valutare i punteggi fuzzy.
+        exact_entry = kb_exact_map.get(normalized_user_input)
+        if exact_entry is not None:
+            answers[query_idx] = _format_entry_response(exact_entry)
             continue
 
-        # 2. Calcolo del punteggio finale considerando specificità e level
-        # Inizializza il punteggio finale con il punteggio testuale
-        final_entry_score = float(current_text_match_score)
-
-        specificity_score = entry.get("specificity_score", 50) # Default a media specificità
-        level = entry.get("level", "general") # Default a general
-
-        # Logica di priorità per specificità e level:
-        if query_is_potentially_generic:
-            # Per domande generiche, favorisci risposte 'general' e con basso `specificity_score`
-            if level == "general":
-                final_entry_score += 20 # Bonus per level general su query generica
-            # Penalizza o favorisci in base a `specificity_score` (inversamente)
-            # Un `specificity_score` più basso è migliore per query generiche.
-            # Normalizziamo il punteggio di specificità (0-100) in un modificatore.
-            # Ad esempio, un punteggio di 10 (molto generale) aggiunge di più di un punteggio di 80.
-            final_entry_score += (100 - specificity_score) * 0.2 # Modificatore basato su quanto è generale
-        else: # Query probabilmente specifica
-            # Per domande specifiche, favorisci risposte con alto `specificity_score`
-            # a meno che il level sia 'general' e il match testuale non sia altissimo.
-            if level == "specific":
-                 final_entry_score += 15 # Bonus per level specific su query specifica
-            final_entry_score += specificity_score * 0.3 # Modificatore basato su quanto è specifica
-
-            # Se una risposta 'general' ha un match testuale molto alto, può comunque essere una buona candidata
-            if level == "general" and current_text_match_score >= HIGH_FUZZY_SCORE_FOR_SPECIFIC_OVERRIDE:
-                final_entry_score += 10 # Piccolo bonus per risposte generali con ottimo match testuale anche per query specifiche
-            elif level == "general": # Penalizza risposte generali per query specifiche se il match non è eccellente
-                final_entry_score -= (specificity_score * 0.1)
-
-
-        # Ulteriore bonus se la domanda principale (non varianti) ha un match molto forte,
-        # indica che la entry è stata pensata primariamente per quel tipo di domanda.
-        if score_domanda > 90 and score_domanda >= current_text_match_score: # score_domanda è il match con entry["domanda"]
-            final_entry_score += 5
-
-        # DEBUG: print(f"Entry ID {entry.get('id')}: Text Score: {current_text_match_score}, Specificity: {specificity_score}, Level: {level}, Query Generic: {query_is_potentially_generic}, Final Score: {final_entry_score}")
-
-        if final_entry_score > highest_score:
-            highest_score = final_entry_score
-            best_match_entry = entry
-        elif final_entry_score == highest_score and best_match_entry is not None:
-            # Tie-breaking:
-            # 1. Preferisci specificità più alta se la query non è generica
-            # 2. Preferisci specificità più bassa (più generale) se la query è generica
-            # 3. Preferisci match testuale più alto se gli altri fattori sono uguali
-
-            current_specificity = entry.get("specificity_score", 50)
-            best_specificity = best_match_entry.get("specificity_score", 50)
-
-            prefer_current = False
-            if query_is_potentially_generic:
-                if current_specificity < best_specificity: # Più generale è meglio
-                    prefer_current = True
-                elif current_specificity == best_specificity and current_text_match_score > fuzz.WRatio(normalized_user_input, normalize_text_for_search(best_match_entry.get("domanda",""))):
-                     prefer_current = True # Se stessa generalità, preferisci miglior match testuale
-            else: # Query specifica
-                if current_specificity > best_specificity: # Più specifico è meglio
-                    prefer_current = True
-                elif current_specificity == best_specificity and current_text_match_score > fuzz.WRatio(normalized_user_input, normalize_text_for_search(best_match_entry.get("domanda",""))):
-                    prefer_current = True # Se stessa specificità, preferisci miglior match testuale
-
-            if prefer_current:
-                 best_match_entry = entry
-
-
-    if best_match_entry:
-        # print(f"DEBUG: Best match for '{user_input}': Entry ID {best_match_entry.get('id')}, Score: {highest_score}, Answer: {best_match_entry.get('risposta')[:60]}...")
-        response_text = best_match_entry.get("risposta", "Risposta non trovata per questa voce.")
-        followups = best_match_entry.get("followup_suggestions", [])
-        if followups:
-            response_text += "\n\nPotresti anche chiedermi:\n" + "\n".join([f"- {sugg}" for sugg in followups])
-        return response_text
-
-    # Messaggio "Non so" migliorato
-    # print(f"DEBUG: No suitable match found for '{user_input}' with new logic. Highest score: {highest_score}")
-    return "Mi dispiace, non ho trovato una risposta precisa nella mia attuale base di conoscenza. Prova a riformulare la tua domanda o a chiedere qualcosa di più specifico."
+        candidates: set[int] = set()
+        for token in normalized_user_input.split():
+            candidates.update(kb_index.get(token, ()))
+        pending.append({
+            'query_idx': query_idx,
+            'normalized': normalized_user_input,
+            'is_generic': is_query_generic(normalized_user_input, COMMON_GENERIC_TERMS),
+            'cands': candidates if candidates else None,
+            'best_entry': None,
+            'highest_score': -1,
+            'best_score_domanda': 0, # Punteggio sulla domanda principale della best entry (per i tie-break)
+        })
+
+    if pending:
+        if any(state['cands'] is None for state in pending):
+            idxs_to_scan = range(len(knowledge_base_entries))
+        else:
+            union: set[int] = set()
+            for state in pending:
+                union |= state['cands']
+            idxs_to_scan = sorted(union)
+
+        for idx in idxs_to_scan:
+            entry = knowledge_base_entries[idx]
+            q_text, v_texts = kb_norm_texts[idx]
+            specificity_score = entry.get("specificity_score", 50) # Default a media specificità
+            level = entry.get("level", "general") # Default a general
+
+            for state in pending:
+                if state['cands'] is not None and idx not in state['cands']:
+                    continue
+                normalized_user_input = state['normalized']
+
+                # 1. Calcolo del punteggio di similarità testuale (Fuzzy Matching)
+                # Controlla la domanda principale
+                score_domanda = fuzz.WRatio(normalized_user_input, q_text) # WRatio gestisce bene differenze di lunghezza
+                current_text_match_score = score_domanda
+
+                # Controlla le varianti della domanda e prendi il punteggio massimo
+                for v_text in v_texts:
+                    score_variante = fuzz.WRatio(normalized_user_input, v_text)
+                    if score_variante > current_text_match_score:
+                        current_text_match_score = score_variante
+
+                # Se il punteggio di similarità testuale è troppo basso, scarta questa entry
+                if current_text_match_score < MIN_FUZZY_SCORE_THRESHOLD:
+                    continue
+
+                # 2. Calcolo del punteggio finale considerando specificità e level
+                # Inizializza il punteggio finale con il punteggio testuale
+                final_entry_score = float(current_text_match_score)
+
+                # Logica di priorità per specificità e level:
+                if state['is_generic']:
+                    # Per domande generiche, favorisci risposte 'general' e con basso `specificity_score`
+                    if level == "general":
+                        final_entry_score += 20 # Bonus per level general su query generica
+                    # Un `specificity_score` più basso è migliore per query generiche.
+                    final_entry_score += (100 - specificity_score) * 0.2 # Modificatore basato su quanto è generale
+                else: # Query probabilmente specifica
+                    # Per domande specifiche, favorisci risposte con alto `specificity_score`
+                    # a meno che il level sia 'general' e il match testuale non sia altissimo.
+                    if level == "specific":
+                         final_entry_score += 15 # Bonus per level specific su query specifica
+                    final_entry_score += specificity_score * 0.3 # Modificatore basato su quanto è specifica
+
+                    # Se una risposta 'general' ha un match testuale molto alto, può comunque essere una buona candidata
+                    if level == "general" and current_text_match_score >= HIGH_FUZZY_SCORE_FOR_SPECIFIC_OVERRIDE:
+                        final_entry_score += 10 # Piccolo bonus per risposte generali con ottimo match testuale anche per query specifiche
+                    elif level == "general": # Penalizza risposte generali per query specifiche se il match non è eccellente
+                        final_entry_score -= (specificity_score * 0.1)
+
+                # Ulteriore bonus se la domanda principale (non varianti) ha un match molto forte,
+                # indica che la entry è stata pensata primariamente per quel tipo di domanda.
+                if score_domanda > 90 and score_domanda >= current_text_match_score: # score_domanda è il match con entry["domanda"]
+                    final_entry_score += 5
+
+                if final_entry_score > state['highest_score']:
+                    state['highest_score'] = final_entry_score
+                    state['best_entry'] = entry
+                    state['best_score_domanda'] = score_domanda
+                elif final_entry_score == state['highest_score'] and state['best_entry'] is not None:
+                    # Tie-breaking:
+                    # 1. Preferisci specificità più alta se la query non è generica
+                    # 2. Preferisci specificità più bassa (più generale) se la query è generica
+                    # 3. Preferisci match testuale più alto se gli altri fattori sono uguali
+                    best_specificity = state['best_entry'].get("specificity_score", 50)
+
+                    prefer_current = False
+                    if state['is_generic']:
+                        if specificity_score < best_specificity: # Più generale è meglio
+                            prefer_current = True
+                        elif specificity_score == best_specificity and current_text_match_score > state['best_score_domanda']:
+                             prefer_current = True # Se stessa generalità, preferisci miglior match testuale
+                    else: # Query specifica
+                        if specificity_score > best_specificity: # Più specifico è meglio
+                            prefer_current = True
+                        elif specificity_score == best_specificity and current_text_match_score > state['best_score_domanda']:
+                            prefer_current = True # Se stessa specificità, preferisci miglior match testuale
+
+                    if prefer_current:
+                         state['best_entry'] = entry
+                         state['best_score_domanda'] = score_domanda
+
+        for state in pending:
+            if state['best_entry'] is not None:
+                answers[state['query_idx']] = _format_entry_response(state['best_entry'])
+            else:
+                answers[state['query_idx']] = _NO_ANSWER_MESSAGE
+
+    return answers
 
 
 # --- Funzioni relative a CCU e simulazione (principalmente invariate per questo task, eccetto chiamate a KB) ---
+
+# Connessione SQLite condivisa e inizializzata pigramente: evita di ripagare
+# apertura file + pragma + lettura header ad ogni comando CLI che tocca il DB.
+_DB_CONN: sqlite3.Connection | None = None
+_DB_CONN_PATH: str | None = None
+
+def _get_db_conn(db_path: str) -> sqlite3.Connection:
+    global _DB_CONN, _DB_CONN_PATH
+    if _DB_CONN is not None and _DB_CONN_PATH == db_path:
+        return _DB_CONN
+    if _DB_CONN is not None:
+        _DB_CONN.close()
+        _DB_CONN = None
+    data_dir = os.path.dirname(db_path)
+    if data_dir and not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS ccu_readings (
+        timestamp TIMESTAMP,
+        well_pressure_psi REAL,
+        mud_flow_rate_gpm REAL,
+        bop_ram_position_mm REAL,
+        sensor_status TEXT,
+        temperature_celsius REAL
+    )''')
+    # Indice sul timestamp: le query su finestre temporali ("ultimi N record")
+    # scendono nel B-tree invece di scandire l'intero storico.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ccu_timestamp ON ccu_readings(timestamp DESC)')
+    _DB_CONN, _DB_CONN_PATH = conn, db_path
+    return conn
+
+@atexit.register
+def _close_db_conn():
+    global _DB_CONN, _DB_CONN_PATH
+    if _DB_CONN is not None:
+        _DB_CONN.close()
+        _DB_CONN = None
+        _DB_CONN_PATH = None
 def simulate_ccu_data_acquisition(num_records: int) -> pd.DataFrame:
-    data = []
+    """
+    Simula l'acquisizione dei dati CCU generando tutte le colonne come array
+    NumPy (una chiamata al generatore per campo) invece di costruire le righe
+    una per una in un ciclo Python.
+    """
+    rng = np.random.default_rng()
     current_time = datetime.now()
-    wp_start = random.uniform(6000.0, 8000.0)
-    wp_increment = random.uniform(-100.0, 100.0)
-    mf_start = random.uniform(900.0, 1100.0)
-    mf_increment = random.uniform(-20.0, 20.0)
+    wp_start = rng.uniform(6000.0, 8000.0)
+    wp_increment = rng.uniform(-100.0, 100.0)
+    mf_start = rng.uniform(900.0, 1100.0)
+    mf_increment = rng.uniform(-20.0, 20.0)
     ANOMALY_PROBABILITY = 0.10
-    anomaly_active_for = None
-    anomaly_counter = 0
-    for i in range(num_records):
-        timestamp = current_time - timedelta(seconds=random.randint(0, 300))
-        base_wp = wp_start + i * wp_increment
-        base_mf = mf_start + i * mf_increment
-        noise_wp = base_wp * random.uniform(-0.05, 0.05)
-        current_wp = base_wp + noise_wp
-        noise_mf = base_mf * random.uniform(-0.05, 0.05)
-        current_mf = base_mf + noise_mf
-        current_wp = max(0, min(current_wp, 18000))
-        current_mf = max(0, min(current_mf, 2000))
-        current_sensor_status = 'OK'
-        if anomaly_active_for and anomaly_counter > 0:
-            anomaly_type, _ = anomaly_active_for
-            if anomaly_type == 'peak_pressure': current_wp = random.uniform(11000.0, 15000.0)
-            elif anomaly_type == 'drop_pressure': current_wp = random.uniform(3000.0, 4500.0)
-            elif anomaly_type == 'drop_flow': current_mf = random.uniform(300.0, 500.0)
-            elif anomaly_type == 'high_flow': current_mf = random.uniform(1300.0, 1600.0)
-            elif anomaly_type == 'sensor_issue': current_sensor_status = random.choice(['WARNING', 'ALARM'])
-            anomaly_counter -= 1
-            if anomaly_counter == 0: anomaly_active_for = None
-        elif random.random() < ANOMALY_PROBABILITY:
-            anomaly_duration = random.randint(1, 2)
-            anomaly_type = random.choice(['peak_pressure', 'drop_pressure', 'drop_flow', 'high_flow', 'sensor_issue'])
-            anomaly_active_for = (anomaly_type, anomaly_duration)
-            anomaly_counter = anomaly_duration
-            if anomaly_type == 'peak_pressure': current_wp = random.uniform(11000.0, 15000.0)
-            elif anomaly_type == 'drop_pressure': current_wp = random.uniform(3000.0, 4500.0)
-            elif anomaly_type == 'drop_flow': current_mf = random.uniform(300.0, 500.0)
-            elif anomaly_type == 'high_flow': current_mf = random.uniform(1300.0, 1600.0)
-            elif anomaly_type == 'sensor_issue': current_sensor_status = random.choice(['WARNING', 'ALARM'])
-        record = {
-            'timestamp': timestamp, 'well_pressure_psi': round(current_wp, 2),
-            'mud_flow_rate_gpm': round(current_mf, 2),
-            'bop_ram_position_mm': round(random.uniform(0.0, 250.0), 2),
-            'sensor_status': current_sensor_status,
-            'temperature_celsius': round(random.uniform(50.0, 150.0), 2)
-        }
-        data.append(record)
-    df = pd.DataFrame(data)
+
+    idx = np.arange(num_records)
+    current_wp = (wp_start + idx * wp_increment) * (1.0 + rng.uniform(-0.05, 0.05, num_records))
+    current_mf = (mf_start + idx * mf_increment) * (1.0 + rng.uniform(-0.05, 0.05, num_records))
+    current_wp = np.clip(current_wp, 0, 18000)
+    current_mf = np.clip(current_mf, 0, 2000)
+    sensor_status = np.full(num_records, 'OK', dtype=object)
+
+    # Iniezione anomalie vettorializzata: ogni riga ha probabilita' del 10% di
+    # avviare un'anomalia di durata 1-2 righe; le righe "estese" ereditano il
+    # tipo dell'anomalia iniziata sulla riga precedente.
+    starts = rng.random(num_records) < ANOMALY_PROBABILITY
+    durations = rng.integers(1, 3, num_records)
+    anomaly_types = rng.choice(['peak_pressure', 'drop_pressure', 'drop_flow', 'high_flow', 'sensor_issue'],
+                               num_records)
+    active = starts.copy()
+    if num_records > 1:
+        carry = starts[:-1] & (durations[:-1] == 2)
+        inherit = carry & ~starts[1:]
+        anomaly_types[1:][inherit] = anomaly_types[:-1][inherit]
+        active[1:] |= carry
+
+    mask = active & (anomaly_types == 'peak_pressure')
+    current_wp[mask] = rng.uniform(11000.0, 15000.0, mask.sum())
+    mask = active & (anomaly_types == 'drop_pressure')
+    current_wp[mask] = rng.uniform(3000.0, 4500.0, mask.sum())
+    mask = active & (anomaly_types == 'drop_flow')
+    current_mf[mask] = rng.uniform(300.0, 500.0, mask.sum())
+    mask = active & (anomaly_types == 'high_flow')
+    current_mf[mask] = rng.uniform(1300.0, 1600.0, mask.sum())
+    mask = active & (anomaly_types == 'sensor_issue')
+    sensor_status[mask] = rng.choice(['WARNING', 'ALARM'], mask.sum())
+
+    df = pd.DataFrame({
+        'timestamp': pd.Timestamp(current_time) - pd.to_timedelta(rng.integers(0, 301, num_records), unit='s'),
+        'well_pressure_psi': np.round(current_wp, 2),
+        'mud_flow_rate_gpm': np.round(current_mf, 2),
+        'bop_ram_position_mm': np.round(rng.uniform(0.0, 250.0, num_records), 2),
+        'sensor_status': sensor_status,
+        'temperature_celsius': np.round(rng.uniform(50.0, 150.0, num_records), 2)
+    })
     df = df.sort_values(by='timestamp').reset_index(drop=True)
     return df
 
 def analyze_ccu_data(df: pd.DataFrame) -> dict:
     numerical_cols = ['well_pressure_psi', 'mud_flow_rate_gpm', 'bop_ram_position_mm', 'temperature_celsius']
+    stat_names = ['mean', 'std', 'min', 'max']
+    present_cols = [col for col in numerical_cols if col in df.columns]
+    # Un'unica chiamata agg sull'intero DataFrame e raccolta dei valori via
+    # to_numpy(): evita una conversione Series->dict per ogni colonna.
+    stats_arr = df[present_cols].agg(stat_names).to_numpy() if present_cols else None
     analysis_results = {}
     for col in numerical_cols:
         if col in df.columns:
-            stats = df[col].agg(['mean', 'std', 'min', 'max']).to_dict()
-            analysis_results[col] = {stat_name: round(stat_value, 2) if pd.notnull(stat_value) else None
-                                     for stat_name, stat_value in stats.items()}
+            col_values = stats_arr[:, present_cols.index(col)]
+            analysis_results[col] = {stat_name: round(float(stat_value), 2) if pd.notnull(stat_value) else None
+                                     for stat_name, stat_value in zip(stat_names, col_values)}
         else:
             analysis_results[col] = {"error": "Colonna non trovata nel DataFrame"}
     return analysis_results
@@ -347,43 +615,64 @@ def detect_simple_anomalies(df: pd.DataFrame, basic_stats: dict) -> list[dict]:
     anomalies = []
     STD_FACTOR = 2.5
     numerical_cols_for_std_dev_check = ['well_pressure_psi', 'mud_flow_rate_gpm', 'bop_ram_position_mm', 'temperature_celsius']
-    for row in df.itertuples(index=False):
-        ts = row.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        anomaly_record = None
-        for col_name in numerical_cols_for_std_dev_check:
-            if col_name not in basic_stats or 'mean' not in basic_stats[col_name] or 'std' not in basic_stats[col_name]:
-                continue
-            mean_val = basic_stats[col_name]['mean']
-            std_val = basic_stats[col_name]['std']
-            current_val = getattr(row, col_name)
-            if std_val is not None and std_val > 0:
-                lower_bound = mean_val - STD_FACTOR * std_val
-                upper_bound = mean_val + STD_FACTOR * std_val
-                msg_prefix = f"[{ts}] Valore {col_name.replace('_', ' ').capitalize()} anomalo (dev. std.): {current_val:.2f}"
-                msg_details = f"(Media: {mean_val:.2f}, Std: {std_val:.2f}, Limiti: [{lower_bound:.2f}, {upper_bound:.2f}])"
-                if current_val < lower_bound:
-                    anomaly_type_key = f"{col_name}_dev_std_anomala_bassa"
-                    anomaly_record = {'message': f"{msg_prefix} < Soglia Inf. {msg_details}", 'type': anomaly_type_key}
-                    anomalies.append(anomaly_record)
-                elif current_val > upper_bound:
-                    anomaly_type_key = f"{col_name}_dev_std_anomala_alta"
-                    anomaly_record = {'message': f"{msg_prefix} > Soglia Sup. {msg_details}", 'type': anomaly_type_key}
-                    anomalies.append(anomaly_record)
-        if row.sensor_status == 'WARNING':
-            anomaly_record = {'message': f"[{ts}] Stato Sensore: WARNING", 'type': "sensor_warning"}
-            anomalies.append(anomaly_record)
-        elif row.sensor_status == 'ALARM':
-            anomaly_record = {'message': f"[{ts}] Stato Sensore: ALARM", 'type': "sensor_alarm"}
-            anomalies.append(anomaly_record)
+    # Soglie, etichette e template dei messaggi dipendono solo dalle statistiche
+    # di colonna: vengono precalcolati una volta sola, cosi' nel ciclo per riga
+    # resta soltanto un confronto numerico e un format con timestamp e valore.
+    col_checks = []
+    for col_name in numerical_cols_for_std_dev_check:
+        col_stats = basic_stats.get(col_name)
+        if not col_stats or 'mean' not in col_stats or 'std' not in col_stats:
+            continue
+        mean_val = col_stats['mean']
+        std_val = col_stats['std']
+        if std_val is None or std_val <= 0:
+            continue
+        lower_bound = mean_val - STD_FACTOR * std_val
+        upper_bound = mean_val + STD_FACTOR * std_val
+        msg_label = col_name.replace('_', ' ').capitalize()
+        msg_details = f"(Media: {mean_val:.2f}, Std: {std_val:.2f}, Limiti: [{lower_bound:.2f}, {upper_bound:.2f}])"
+        tmpl_low = "[{ts}] Valore " + msg_label + " anomalo (dev. std.): {val:.2f} < Soglia Inf. " + msg_details
+        tmpl_high = "[{ts}] Valore " + msg_label + " anomalo (dev. std.): {val:.2f} > Soglia Sup. " + msg_details
+        col_checks.append((col_name, lower_bound, upper_bound,
+                           tmpl_low, f"{col_name}_dev_std_anomala_bassa",
+                           tmpl_high, f"{col_name}_dev_std_anomala_alta"))
+    # Timestamp formattati in un'unica passata C-level invece di uno strftime
+    # Python per riga.
+    ts_strs = df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+
+    # Confronti vettorializzati per colonna: i messaggi vengono costruiti solo
+    # per le poche righe fuori soglia. flagged tiene (riga, ordine-colonna,
+    # record) per ricomporre l'ordine per-riga del report originale.
+    flagged = []
+    for col_pos, (col_name, lower_bound, upper_bound, tmpl_low, type_low, tmpl_high, type_high) in enumerate(col_checks):
+        values = df[col_name].to_numpy()
+        for i in np.flatnonzero(values < lower_bound):
+            flagged.append((i, col_pos,
+                            {'message': tmpl_low.format(ts=ts_strs[i], val=values[i]), 'type': type_low}))
+        for i in np.flatnonzero(values > upper_bound):
+            flagged.append((i, col_pos,
+                            {'message': tmpl_high.format(ts=ts_strs[i], val=values[i]), 'type': type_high}))
+
+    # Anche lo stato sensori usa due maschere booleane invece di due confronti
+    # Python per riga: i record vengono emessi solo per gli indici flaggati.
+    status_arr = df['sensor_status'].to_numpy()
+    sensor_pos = len(col_checks)
+    for i in np.flatnonzero(status_arr == 'WARNING'):
+        flagged.append((i, sensor_pos, {'message': f"[{ts_strs[i]}] Stato Sensore: WARNING", 'type': "sensor_warning"}))
+    for i in np.flatnonzero(status_arr == 'ALARM'):
+        flagged.append((i, sensor_pos, {'message': f"[{ts_strs[i]}] Stato Sensore: ALARM", 'type': "sensor_alarm"}))
+
+    flagged.sort(key=lambda item: (item[0], item[1]))
+    anomalies.extend(record for _, _, record in flagged)
     return anomalies
 
 def generate_anomaly_report(anomalies_details: list[dict], knowledge_base: dict) -> str:
     if not anomalies_details:
         return "Report Anomalie: Nessuna anomalia significativa rilevata."
+    # Il report viene assemblato in una lista pre-dimensionata e unito con una
+    # singola join finale.
     report_parts = ["REPORT ANOMALIE RILEVATE:"]
-    for detail in anomalies_details:
-        report_parts.append(f"  - {detail['message']}")
-    suggestions_found = []
+    report_parts.extend(f"  - {detail['message']}" for detail in anomalies_details)
     # Modificato per riflettere che knowledge_base è ora una lista di entries.
     # La logica specifica per "problem_solving_suggestions" dovrebbe essere rivista
     # se queste informazioni sono ora integrate nelle entries standard.
@@ -410,10 +699,12 @@ def generate_anomaly_report(anomalies_details: list[dict], knowledge_base: dict)
 def assess_sensor_health(df: pd.DataFrame) -> dict:
     if df is None or df.empty or 'sensor_status' not in df.columns:
         return {'OK': 0, 'WARNING': 0, 'ALARM': 0, 'percent_warning': 0.0, 'percent_alarm': 0.0, 'overall_health': 'Indeterminato (dati non disponibili o colonna sensor_status mancante)'}
-    counts = df['sensor_status'].value_counts()
-    ok_count = counts.get('OK', 0)
-    warning_count = counts.get('WARNING', 0)
-    alarm_count = counts.get('ALARM', 0)
+    # Tre confronti vettorializzati al posto di value_counts: niente Series
+    # intermedia ne' ordinamento dei conteggi.
+    status_arr = df['sensor_status'].to_numpy()
+    ok_count = int(np.count_nonzero(status_arr == 'OK'))
+    warning_count = int(np.count_nonzero(status_arr == 'WARNING'))
+    alarm_count = int(np.count_nonzero(status_arr == 'ALARM'))
     total_records = len(df)
     if total_records == 0: return {'OK': 0, 'WARNING': 0, 'ALARM': 0, 'percent_warning': 0.0, 'percent_alarm': 0.0, 'overall_health': 'Indeterminato (nessun record)'}
     percent_warning = round((warning_count / total_records) * 100, 2)
@@ -447,12 +738,18 @@ def save_ccu_data(df: pd.DataFrame, db_path: str = DB_PATH) -> bool:
         print("Nessun dato CCU da salvare.")
         return False
     try:
-        data_dir = os.path.dirname(db_path)
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-        conn = sqlite3.connect(db_path)
-        df.to_sql('ccu_readings', conn, if_exists='append', index=False)
-        conn.close()
+        # L'inserimento avviene in blocco con executemany dentro una singola
+        # transazione sulla connessione condivisa (WAL, synchronous NORMAL),
+        # evitando il dispatch per-riga di DataFrame.to_sql.
+        conn = _get_db_conn(db_path)
+        records = df.copy()
+        # Timestamp in formato testo ISO, come li salvava to_sql.
+        records['timestamp'] = records['timestamp'].astype(str)
+        columns = list(records.columns)
+        placeholders = ', '.join('?' * len(columns))
+        insert_sql = f"INSERT INTO ccu_readings ({', '.join(columns)}) VALUES ({placeholders})"
+        with conn:
+            conn.executemany(insert_sql, records.itertuples(index=False, name=None))
         return True
     except sqlite3.Error as e:
         print(f"Errore SQLite durante il salvataggio dei dati CCU: {e}")
@@ -465,16 +762,14 @@ def load_ccu_data(db_path: str = DB_PATH) -> pd.DataFrame:
     if not os.path.exists(db_path):
         return pd.DataFrame()
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ccu_readings';")
-        if cursor.fetchone() is None:
-            conn.close()
-            return pd.DataFrame()
-        df = pd.read_sql_query("SELECT * FROM ccu_readings", conn)
-        conn.close()
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
+        # La connessione condivisa garantisce gia' l'esistenza della tabella.
+        # Lista colonne esplicita (niente SELECT *) e parse_dates per convertire
+        # i timestamp in un'unica passata dentro il reader pandas.
+        conn = _get_db_conn(db_path)
+        columns = ("timestamp, well_pressure_psi, mud_flow_rate_gpm, "
+                   "bop_ram_position_mm, sensor_status, temperature_celsius")
+        df = pd.read_sql_query(f"SELECT {columns} FROM ccu_readings", conn,
+                               parse_dates=['timestamp'])
         return df
     except sqlite3.Error as e:
         print(f"Errore SQLite durante il caricamento dei dati CCU: {e}")
@@ -483,7 +778,33 @@ def load_ccu_data(db_path: str = DB_PATH) -> pd.DataFrame:
         print(f"Errore imprevisto durante il caricamento dei dati CCU: {e}")
         return pd.DataFrame()
 
+def load_recent_ccu_data(num_records: int, db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Carica solo gli ultimi `num_records` record CCU in ordine cronologico.
+    Sfrutta l'indice su timestamp (ORDER BY ... LIMIT), quindi il costo dipende
+    dalla finestra richiesta e non dalla dimensione dello storico.
+    """
+    if not os.path.exists(db_path):
+        return pd.DataFrame()
+    try:
+        conn = _get_db_conn(db_path)
+        columns = ("timestamp, well_pressure_psi, mud_flow_rate_gpm, "
+                   "bop_ram_position_mm, sensor_status, temperature_celsius")
+        df = pd.read_sql_query(
+            f"SELECT {columns} FROM ccu_readings ORDER BY timestamp DESC LIMIT ?",
+            conn, params=(num_records,), parse_dates=['timestamp'])
+        # La query restituisce i record dal piu' recente: li riporta in ordine
+        # cronologico come load_ccu_data.
+        return df.iloc[::-1].reset_index(drop=True)
+    except sqlite3.Error as e:
+        print(f"Errore SQLite durante il caricamento dei dati CCU recenti: {e}")
+        return pd.DataFrame()
+    except Exception as e:
+        print(f"Errore imprevisto durante il caricamento dei dati CCU recenti: {e}")
+        return pd.DataFrame()
+
 def start_pascal_cli():
+    compact_knowledge_additions(KNOWLEDGE_BASE_PATH)
     knowledge_base = load_knowledge_base(KNOWLEDGE_BASE_PATH)
     if not knowledge_base:
         print("Avvio di P.A.S.C.A.L. non riuscito a causa di problemi con la base di conoscenza principale.")
@@ -524,80 +845,91 @@ def start_pascal_cli():
         #     continue
 
         if user_input_lower == 'simula dati ccu':
-            print("\n--- Simulazione Dati CCU ---")
+            # Le righe vengono accumulate e scritte su stdout in un colpo solo:
+            # una write invece di una print (con lock e flush) per riga.
+            out = []
+            w = out.append
+            w("\n--- Simulazione Dati CCU ---")
             df_ccu = None # Inizializza per il blocco finally o per controllo
             analysis = None
             anomalies_details_list = []
             sensor_health_assessment = {}
             try:
                 df_ccu = simulate_ccu_data_acquisition(num_records=10)
-                print("Dati CCU simulati e acquisiti con successo!")
-                print("\nPrime 5 righe dei dati CCU simulati:")
-                print(df_ccu.head().to_string())
+                w("Dati CCU simulati e acquisiti con successo!")
+                w("\nPrime 5 righe dei dati CCU simulati:")
+                # to_csv con separatore tab evita la costosa pipeline di
+                # formattazione a larghezza di colonna di to_string.
+                w(df_ccu.head().to_csv(sep='\t', index=False))
 
                 analysis = analyze_ccu_data(df_ccu)
-                print("\nAnalisi di base dei dati CCU:")
+                w("\nAnalisi di base dei dati CCU:")
                 for column_name, stats_dict in analysis.items():
-                    print(f"\nStatistiche per {column_name}:")
-                    if "error" in stats_dict: print(f"  - Errore: {stats_dict['error']}")
+                    w(f"\nStatistiche per {column_name}:")
+                    if "error" in stats_dict: w(f"  - Errore: {stats_dict['error']}")
                     else:
                         for stat_name, stat_value in stats_dict.items():
                             value_str = f"{stat_value:.2f}" if stat_value is not None else "N/A"
-                            print(f"  - {stat_name.capitalize()}: {value_str}")
+                            w(f"  - {stat_name.capitalize()}: {value_str}")
 
                 anomalies_details_list = detect_simple_anomalies(df_ccu, analysis)
                 anomaly_report_str = generate_anomaly_report(anomalies_details_list, knowledge_base)
-                print(f"\n{anomaly_report_str}")
+                w(f"\n{anomaly_report_str}")
 
                 sensor_health_assessment = assess_sensor_health(df_ccu)
-                print("\nValutazione Salute Sensori:")
-                print(f"  - Conteggio OK: {sensor_health_assessment.get('OK',0)}")
-                print(f"  - Conteggio WARNING: {sensor_health_assessment.get('WARNING',0)}")
-                print(f"  - Conteggio ALARM: {sensor_health_assessment.get('ALARM',0)}")
-                print(f"  - Percentuale WARNING: {sensor_health_assessment.get('percent_warning',0.0):.2f}%")
-                print(f"  - Percentuale ALARM: {sensor_health_assessment.get('percent_alarm',0.0):.2f}%")
-                print(f"  - Stato Generale Sensori: {sensor_health_assessment.get('overall_health','Indeterminato')}")
+                w("\nValutazione Salute Sensori:")
+                w(f"  - Conteggio OK: {sensor_health_assessment.get('OK',0)}")
+                w(f"  - Conteggio WARNING: {sensor_health_assessment.get('WARNING',0)}")
+                w(f"  - Conteggio ALARM: {sensor_health_assessment.get('ALARM',0)}")
+                w(f"  - Percentuale WARNING: {sensor_health_assessment.get('percent_warning',0.0):.2f}%")
+                w(f"  - Percentuale ALARM: {sensor_health_assessment.get('percent_alarm',0.0):.2f}%")
+                w(f"  - Stato Generale Sensori: {sensor_health_assessment.get('overall_health','Indeterminato')}")
 
                 overall_summary = generate_overall_status_summary(anomalies_details_list, sensor_health_assessment)
-                print("\n\nRiepilogo Stato Sistema:")
-                print(f"  {overall_summary}")
+                w("\n\nRiepilogo Stato Sistema:")
+                w(f"  {overall_summary}")
 
                 if df_ccu is not None and not df_ccu.empty:
-                    if save_ccu_data(df_ccu): print("\nDati CCU simulati salvati nel database per analisi futura.")
-                    else: print("\nErrore durante il salvataggio dei dati CCU simulati nel database.")
+                    if save_ccu_data(df_ccu): w("\nDati CCU simulati salvati nel database per analisi futura.")
+                    else: w("\nErrore durante il salvataggio dei dati CCU simulati nel database.")
 
             except Exception as e:
-                print(f"Errore durante la simulazione, analisi o salvataggio dei dati CCU: {e}")
-            print("----------------------------\n")
+                w(f"Errore durante la simulazione, analisi o salvataggio dei dati CCU: {e}")
+            w("----------------------------\n")
+            sys.stdout.write('\n'.join(out) + '\n')
+            sys.stdout.flush()
             continue
 
         if user_input_lower == 'mostra dati storici ccu':
-            print("\n--- Dati Storici CCU ---")
+            out = []
+            w = out.append
+            w("\n--- Dati Storici CCU ---")
             df_historical = load_ccu_data()
             if not df_historical.empty:
-                print("Dati storici CCU caricati con successo.")
-                print(f"Numero totale di record storici: {len(df_historical)}")
-                print("\nPrime 5 righe dei dati storici CCU:")
-                print(df_historical.head().to_string())
+                w("Dati storici CCU caricati con successo.")
+                w(f"Numero totale di record storici: {len(df_historical)}")
+                w("\nPrime 5 righe dei dati storici CCU:")
+                w(df_historical.head().to_csv(sep='\t', index=False))
                 historical_analysis = analyze_ccu_data(df_historical)
-                print("\nAnalisi di base dei dati storici CCU:")
+                w("\nAnalisi di base dei dati storici CCU:")
                 for column_name, stats_dict in historical_analysis.items():
-                    print(f"\nStatistiche per {column_name}:")
-                    if "error" in stats_dict: print(f"  - Errore: {stats_dict['error']}")
+                    w(f"\nStatistiche per {column_name}:")
+                    if "error" in stats_dict: w(f"  - Errore: {stats_dict['error']}")
                     else:
                         for stat_name, stat_value in stats_dict.items():
                             value_str = f"{stat_value:.2f}" if stat_value is not None else "N/A"
-                            print(f"  - {stat_name.capitalize()}: {value_str}")
+                            w(f"  - {stat_name.capitalize()}: {value_str}")
             else:
-                print("Nessun dato storico CCU da mostrare o errore durante il caricamento.")
-            print("------------------------\n")
+                w("Nessun dato storico CCU da mostrare o errore durante il caricamento.")
+            w("------------------------\n")
+            sys.stdout.write('\n'.join(out) + '\n')
+            sys.stdout.flush()
             continue
 
         sub_question_strings = decompose_question(user_input_original)
+        answers = find_answers_for_queries(sub_question_strings, knowledge_base)
         collected_answers = []
-        for sub_query_string in sub_question_strings:
-            if not sub_query_string.strip(): continue
-            answer = find_answer_for_query(sub_query_string, knowledge_base)
+        for answer in answers:
             if answer and answer not in collected_answers: collected_answers.append(answer)
 
         if collected_answers: print("\n---\n".join(collected_answers))
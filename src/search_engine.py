@@ -1,20 +1,237 @@
+import functools
+import heapq
 import json
+import logging
+import mmap
 import os
-from rapidfuzz import fuzz # Import per il fuzzy matching
+import re
+import string
+import sys
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Tabella di normalizzazione costruita una volta a import time: punteggiatura
+# -> spazio, vocali accentate -> vocale semplice (il testo è già minuscolo
+# quando viene applicata). Un'unica str.translate sostituisce più passate di
+# replace/regex. Pattern per collassare gli spazi multipli.
+_NORMALIZE_TABLE = str.maketrans({char: " " for char in string.punctuation})
+_NORMALIZE_TABLE.update(str.maketrans("àáâèéêìíîòóôùúû", "aaaeeeiiiooouuu"))
+_WS_RE = re.compile(r"\s+")
+
+# rapidfuzz viene importato pigramente al primo uso fuzzy: chi fa solo
+# ricerche esatte non paga il caricamento dell'estensione C a import time.
+_fuzz = None
+_process = None
+
+class _DifflibFuzz:
+    """
+    Scorer di ripiego in puro Python (difflib) con la stessa interfaccia di
+    rapidfuzz.fuzz, usato quando rapidfuzz non è installato: più lento ma
+    permette comunque la ricerca fuzzy.
+    """
+    @staticmethod
+    def WRatio(s1: str, s2: str, score_cutoff: float = 0.0) -> float:
+        import difflib
+        matcher = difflib.SequenceMatcher(None, s1, s2)
+        score = matcher.ratio() * 100.0
+        # Approssima la componente "partial" di WRatio: caratteri in comune
+        # rapportati alla stringa più corta, attenuati come fa rapidfuzz (0.9),
+        # così una query contenuta in un testo lungo non viene penalizzata.
+        shorter = min(len(s1), len(s2))
+        if shorter:
+            matched = sum(block.size for block in matcher.get_matching_blocks())
+            partial = matched / shorter * 90.0
+            if partial > score:
+                score = partial
+        return score if score >= score_cutoff else 0.0
+
+class _DifflibProcess:
+    """Ripiego per rapidfuzz.process limitato a cdist/extractOne, nella forma usata qui."""
+    @staticmethod
+    def cdist(queries, choices, scorer=None, score_cutoff: float = 0.0, **_kwargs):
+        if scorer is None:
+            scorer = _DifflibFuzz.WRatio
+        return [[scorer(q, c, score_cutoff=score_cutoff) for c in choices] for q in queries]
+
+    @staticmethod
+    def extractOne(query, choices, scorer=None, score_cutoff: float = 0.0, **_kwargs):
+        if scorer is None:
+            scorer = _DifflibFuzz.WRatio
+        best = None
+        for index, choice in enumerate(choices):
+            score = scorer(query, choice, score_cutoff=score_cutoff)
+            if score >= score_cutoff and (best is None or score > best[1]):
+                best = (choice, score, index)
+        return best
+
+def _get_fuzz_modules():
+    global _fuzz, _process
+    if _fuzz is None:
+        try:
+            from rapidfuzz import fuzz, process # Import per il fuzzy matching
+        except ImportError:
+            fuzz, process = _DifflibFuzz, _DifflibProcess
+        _fuzz = fuzz
+        _process = process
+    return _fuzz, _process
+
+# orjson (parser C, opzionale) accelera il parse della knowledge base e lavora
+# direttamente sui bytes; in sua assenza si usa lo stdlib json.
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+def _json_loads(data: bytes):
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+# ijson (opzionale) permette il parse incrementale di KB molto grandi senza
+# tenere in memoria l'intero testo JSON oltre all'albero di oggetti.
+try:
+    import ijson as _ijson
+except ImportError:
+    _ijson = None
+
+# Oltre questa dimensione (50 MB) il caricamento passa al parse in streaming.
+_STREAMING_SIZE_THRESHOLD = 50 * 1024 * 1024
+
+# Da questa dimensione (1 MB) in su il parse con orjson avviene su file
+# mappato in memoria, senza copiarne prima il contenuto in heap.
+_MMAP_SIZE_THRESHOLD = 1 * 1024 * 1024
+
+def _load_knowledge_base_jsonl(file_path: str) -> list[dict]:
+    """
+    Carica una knowledge base in formato JSON Lines (una voce per riga).
+    Il parse riga per riga non bufferizza mai l'intero documento e rende
+    banale l'append incrementale di nuove voci al file.
+    """
+    try:
+        entries = []
+        with open(file_path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(_json_loads(line))
+        return _precompute_entry_fields(entries)
+    except FileNotFoundError:
+        logger.warning(f"Errore: File della knowledge base non trovato in {file_path}")
+        return []
+    except ValueError:
+        logger.warning(f"Errore: Il file della knowledge base in {file_path} contiene righe JSON non valide.")
+        return []
+
+def _load_knowledge_base_streaming(file_path: str) -> list[dict]:
+    """
+    Carica le entries in streaming con ijson: le voci vengono materializzate
+    una alla volta, senza bufferizzare l'intero documento JSON. Supporta sia
+    l'oggetto con chiave 'entries' sia la lista di entries alla radice.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            first_byte = f.read(1)
+            while first_byte and first_byte.isspace():
+                first_byte = f.read(1)
+            f.seek(0)
+            prefix = 'entries.item' if first_byte == b'{' else 'item'
+            entries = [entry for entry in _ijson.items(f, prefix)]
+        return _precompute_entry_fields(entries)
+    except FileNotFoundError:
+        logger.warning(f"Errore: File della knowledge base non trovato in {file_path}")
+        return []
+    except Exception as e:
+        logger.warning(f"Errore durante il parse in streaming della knowledge base in {file_path}: {e}")
+        return []
 
 # Definisce il percorso predefinito relativo alla posizione di questo script
 DEFAULT_KB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge_base.json')
 
 def _normalize_text_for_search(text: str) -> str:
     """
-    Helper function to normalize text for searching (lowercase).
-    Potrebbe essere espansa per rimuovere punteggiatura o altro se necessario.
+    Helper function to normalize text for searching (lowercase, senza
+    punteggiatura né accenti, spazi collassati). La punteggiatura diventa
+    spazio, non viene cancellata: "l'energia" deve normalizzare in
+    "l energia" e non in "lenergia", altrimenti i token si fondono; gli
+    accenti vengono invece rimossi ("perché" -> "perche"), così le query
+    digitate senza accenti trovano comunque le voci.
     """
     if not isinstance(text, str):
         return ""
-    return text.lower()
-
-def calculate_confidence_score(query: str, entry: dict, is_exact_match: bool = False) -> float:
+    # NFKC ricompone le forme Unicode equivalenti (es. "è" decomposta vs
+    # precomposta) prima del folding; il testo ASCII è già in forma normale
+    # e salta il passaggio.
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text)
+    # str.lower alloca sempre una nuova stringa: se il testo è già minuscolo
+    # (il caso tipico dopo il precompute) si restituisce l'originale.
+    lowered = text if text.islower() else text.lower()
+    stripped = lowered.translate(_NORMALIZE_TABLE)
+    if stripped != lowered:
+        # Il collasso degli spazi serve solo se la traduzione ha toccato
+        # qualcosa: il pattern è compilato una volta a import time.
+        stripped = _WS_RE.sub(" ", stripped).strip()
+    return stripped
+
+def _precompute_entry_fields(entries: list[dict]) -> list[dict]:
+    """
+    Valida le voci e materializza i campi normalizzati ("_domanda_lc",
+    "_varianti_lc") una sola volta al caricamento: le voci malformate (non
+    dizionari, o con "domanda" non stringa) vengono scartate qui, così le
+    funzioni di ricerca possono leggere i campi senza controlli di tipo né
+    rinormalizzazioni per query.
+    """
+    valid_entries = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        domanda = entry.get("domanda", "")
+        if not isinstance(domanda, str):
+            continue
+        # sys.intern deduplica i testi ripetuti tra le voci: meno memoria e
+        # confronti di uguaglianza che diventano confronti di identità. Vale
+        # anche per i campi grezzi, che in KB reali ripetono spesso le stesse
+        # stringhe brevi (alias condivisi, risposte standard).
+        entry["domanda"] = domanda = sys.intern(domanda)
+        risposta = entry.get("risposta")
+        if isinstance(risposta, str):
+            entry["risposta"] = sys.intern(risposta)
+        entry["_domanda_lc"] = sys.intern(_normalize_text_for_search(domanda))
+        varianti = entry.get("varianti_domanda", ())
+        if isinstance(varianti, list):
+            entry["varianti_domanda"] = [sys.intern(v) if isinstance(v, str) else v
+                                         for v in varianti]
+        if isinstance(varianti, list):
+            # Tupla invece di lista: sempre presente (vuota se mancante), è
+            # immutabile e la tupla vuota è un singleton condiviso — il ciclo
+            # caldo itera senza default, isinstance né allocazioni per query.
+            entry["_varianti_lc"] = tuple(sys.intern(_normalize_text_for_search(v))
+                                          for v in varianti if isinstance(v, str))
+        else:
+            entry["_varianti_lc"] = ()
+        valid_entries.append(entry)
+    return valid_entries
+
+def _get_domanda_lc(entry: dict) -> str:
+    """Restituisce la domanda normalizzata, precalcolata o calcolata al volo."""
+    lc = entry.get("_domanda_lc")
+    if lc is None:
+        lc = _normalize_text_for_search(entry.get("domanda", ""))
+    return lc
+
+def _get_varianti_lc(entry: dict) -> tuple[str, ...]:
+    """Restituisce le varianti normalizzate, precalcolate o calcolate al volo."""
+    lc = entry.get("_varianti_lc")
+    if lc is None:
+        varianti = entry.get("varianti_domanda", ())
+        if not isinstance(varianti, list):
+            return ()
+        lc = tuple(_normalize_text_for_search(v) for v in varianti if isinstance(v, str))
+    return lc
+
+def calculate_confidence_score(query: str, entry: dict, is_exact_match: bool = False,
+                               score_cutoff: float = 0.0) -> float:
     """
     Calcola il punteggio di confidenza per una data query rispetto a una voce della knowledge base.
 
@@ -32,6 +249,10 @@ def calculate_confidence_score(query: str, entry: dict, is_exact_match: bool = F
                       e "varianti_domanda".
         is_exact_match (bool, optional): Se True, la funzione restituisce 100.
                                          Default a False.
+        score_cutoff (float, optional): Soglia minima di interesse: i confronti
+                                        che non possono raggiungerla vengono
+                                        interrotti in anticipo da rapidfuzz (e
+                                        valgono 0). Default a 0 (nessun taglio).
 
     Returns:
         float: Il punteggio di confidenza (0-100). Restituisce 0 se la query o l'entry
@@ -49,64 +270,162 @@ def calculate_confidence_score(query: str, entry: dict, is_exact_match: bool = F
     if not normalized_query:
         return 0.0
 
-    max_score = 0.0
-
-    # Controlla la domanda principale
-    domanda_text = entry.get("domanda", "")
-    normalized_domanda = _normalize_text_for_search(domanda_text)
+    choices = []
+    normalized_domanda = _get_domanda_lc(entry)
     if normalized_domanda:
-        score_domanda = fuzz.WRatio(normalized_query, normalized_domanda)
-        if score_domanda > max_score:
-            max_score = score_domanda
-
-    # Controlla le varianti della domanda
-    varianti = entry.get("varianti_domanda", [])
-    if isinstance(varianti, list):
-        for variante_text in varianti:
-            normalized_variante = _normalize_text_for_search(variante_text)
-            if normalized_variante:
-                score_variante = fuzz.WRatio(normalized_query, normalized_variante)
-                if score_variante > max_score:
-                    max_score = score_variante
-
-    return max_score
-
-def load_knowledge_base(file_path: str = DEFAULT_KB_PATH) -> list[dict]:
+        choices.append(normalized_domanda)
+    for normalized_variante in _get_varianti_lc(entry):
+        if normalized_variante:
+            choices.append(normalized_variante)
+    if not choices:
+        return 0.0
+
+    # extractOne esegue il ciclo sui candidati in C++ con early-exit: si
+    # ferma appena nessun candidato residuo può battere il miglior punteggio.
+    fuzz, process = _get_fuzz_modules()
+    best = process.extractOne(normalized_query, choices,
+                              scorer=fuzz.WRatio, score_cutoff=score_cutoff)
+    return float(best[1]) if best is not None else 0.0
+
+# Cache dei caricamenti riusciti: percorso assoluto -> (mtime_ns, size,
+# entries). Con file invariato si salta I/O e parse JSON, e restituire lo
+# stesso oggetto lista mantiene validi gli indici derivati (es. indice esatto).
+_KB_FILE_CACHE: dict[str, tuple[int, int, list[dict]]] = {}
+
+def load_knowledge_base(file_path=DEFAULT_KB_PATH) -> list[dict]:
     """
     Carica la knowledge base da un file JSON.
 
+    I caricamenti riusciti sono memoizzati su (mtime, dimensione) del file:
+    finché il file non cambia, le chiamate successive restituiscono la lista
+    già in memoria senza rileggere né riparsare il JSON.
+
+    I file con estensione '.jsonl' vengono interpretati come JSON Lines
+    (una voce per riga) e caricati incrementalmente riga per riga.
+
     Args:
-        file_path (str): Il percorso del file JSON della knowledge base.
-                         Default a 'data/knowledge_base.json' relativo alla root del progetto.
+        file_path: Il percorso del file JSON della knowledge base, oppure un
+                   oggetto file-like già aperto in binario (es. io.BytesIO):
+                   in tal caso il contenuto viene letto e parsato direttamente,
+                   senza I/O su disco né memoizzazione.
+                   Default a 'data/knowledge_base.json' relativo alla root del progetto.
 
     Returns:
         list[dict]: Una lista di dizionari, dove ogni dizionario rappresenta una voce
                     della knowledge base. Restituisce una lista vuota se il file non viene
                     trovato, non è un JSON valido, o non ha la struttura attesa.
     """
+    if hasattr(file_path, "read"):
+        # Sorgente file-like: niente stat né cache (non c'è un percorso su cui
+        # chiavarla), solo parse del contenuto.
+        return _parse_knowledge_base_bytes(file_path.read(), repr(file_path))
+    cache_key = os.path.abspath(file_path)
+    try:
+        st = os.stat(file_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None
+    if stamp is not None:
+        cached = _KB_FILE_CACHE.get(cache_key)
+        if cached is not None and (cached[0], cached[1]) == stamp:
+            return cached[2]
+    if file_path.endswith('.jsonl'):
+        entries = _load_knowledge_base_jsonl(file_path)
+        if entries and stamp is not None:
+            _KB_FILE_CACHE[cache_key] = (stamp[0], stamp[1], entries)
+        return entries
+    if (_ijson is not None and stamp is not None
+            and stamp[1] >= _STREAMING_SIZE_THRESHOLD):
+        entries = _load_knowledge_base_streaming(file_path)
+        if entries:
+            _KB_FILE_CACHE[cache_key] = (stamp[0], stamp[1], entries)
+        return entries
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, dict) and "entries" in data and isinstance(data["entries"], list):
-                return data["entries"]
-            elif isinstance(data, list): # Supporta anche il caso in cui il JSON sia direttamente una lista di entries
-                return data
+        # Lettura in binario: orjson parsa i bytes direttamente, senza il
+        # round-trip di decodifica UTF-8 in str.
+        with open(file_path, 'rb') as f:
+            if (_orjson is not None and stamp is not None
+                    and stamp[1] >= _MMAP_SIZE_THRESHOLD):
+                # File grandi: mmap evita la doppia bufferizzazione — orjson
+                # consuma i bytes direttamente dalle pagine mappate dal kernel
+                # invece che da una copia letta in heap.
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        entries = _parse_knowledge_base_bytes(view, file_path)
+                    finally:
+                        view.release()
             else:
-                print(f"Errore: Il file della knowledge base in {file_path} non ha la struttura attesa (oggetto con chiave 'entries' o lista di entries).")
-                return []
+                entries = _parse_knowledge_base_bytes(f.read(), file_path)
     except FileNotFoundError:
-        print(f"Errore: File della knowledge base non trovato in {file_path}")
+        logger.warning(f"Errore: File della knowledge base non trovato in {file_path}")
         return []
-    except json.JSONDecodeError:
-        print(f"Errore: Il file della knowledge base in {file_path} non è un JSON valido.")
+    if entries and stamp is not None:
+        _KB_FILE_CACHE[cache_key] = (stamp[0], stamp[1], entries)
+    return entries
+
+def _parse_knowledge_base_bytes(raw: bytes, source) -> list[dict]:
+    """Parsa e valida i bytes JSON di una knowledge base (file o file-like)."""
+    try:
+        data = _json_loads(raw)
+    except ValueError: # json.JSONDecodeError e orjson.JSONDecodeError derivano entrambi da ValueError
+        logger.warning(f"Errore: Il file della knowledge base in {source} non è un JSON valido.")
         return []
+    if isinstance(data, dict) and "entries" in data and isinstance(data["entries"], list):
+        return _precompute_entry_fields(data["entries"])
+    if isinstance(data, list): # Supporta anche il caso in cui il JSON sia direttamente una lista di entries
+        return _precompute_entry_fields(data)
+    logger.warning(f"Errore: Il file della knowledge base in {source} non ha la struttura attesa (oggetto con chiave 'entries' o lista di entries).")
+    return []
+
+# Cache (a slot singolo) delle strutture derivate dalla lista di entries: la
+# stessa lista serve molte query consecutive, quindi indici e testi appiattiti
+# vengono costruiti una volta e riusati finché non cambia l'oggetto lista.
+_KB_INDEX_CACHE: dict[int, tuple] = {}
+
+def _get_kb_index(knowledge_base_entries: list[dict]) -> tuple[dict[str, list[int]], list[str], list[tuple[int, int]], dict]:
+    """
+    Costruisce (o recupera dalla cache) le strutture derivate dalle entries:
+      - indice hash testo normalizzato -> indici delle voci (match esatto O(1));
+      - lista piatta di tutti i testi normalizzati (domande e varianti), per
+        lo scoring fuzzy in blocco con process.cdist;
+      - intervalli (start, end) nella lista piatta per ciascuna voce;
+      - memo dei risultati fuzzy per (query, soglia), vuoto alla costruzione.
+    Essendo agganciate alla lista di entries, tutte le strutture (memo incluso)
+    decadono automaticamente quando la KB viene ricaricata.
+    """
+    cached = _KB_INDEX_CACHE.get(id(knowledge_base_entries))
+    if cached is not None and cached[0] is knowledge_base_entries:
+        return cached[1], cached[2], cached[3], cached[4]
+    exact_index: dict[str, list[int]] = {}
+    flat_texts: list[str] = []
+    entry_bounds: list[tuple[int, int]] = []
+    for idx, entry in enumerate(knowledge_base_entries):
+        start = len(flat_texts)
+        domanda_lc = _get_domanda_lc(entry)
+        if domanda_lc:
+            exact_index.setdefault(domanda_lc, []).append(idx)
+            flat_texts.append(domanda_lc)
+        for variante_lc in _get_varianti_lc(entry):
+            if variante_lc:
+                postings = exact_index.setdefault(variante_lc, [])
+                # Evita doppioni se la variante ripete la domanda (stessa voce)
+                if not postings or postings[-1] != idx:
+                    postings.append(idx)
+                flat_texts.append(variante_lc)
+        entry_bounds.append((start, len(flat_texts)))
+    fuzzy_memo: dict = {}
+    _KB_INDEX_CACHE.clear()
+    _KB_INDEX_CACHE[id(knowledge_base_entries)] = (knowledge_base_entries, exact_index, flat_texts, entry_bounds, fuzzy_memo)
+    return exact_index, flat_texts, entry_bounds, fuzzy_memo
 
 def search_exact(query: str, knowledge_base_entries: list[dict]) -> list[dict]:
     """
     Cerca una corrispondenza esatta (case-insensitive) della query nella knowledge base.
 
     La ricerca viene effettuata nel campo "domanda" e in ogni stringa
-    all'interno della lista "varianti_domanda" di ciascuna voce.
+    all'interno della lista "varianti_domanda" di ciascuna voce, tramite
+    l'indice hash costruito da _get_exact_index.
 
     Args:
         query (str): La stringa di ricerca.
@@ -122,32 +441,17 @@ def search_exact(query: str, knowledge_base_entries: list[dict]) -> list[dict]:
        not isinstance(knowledge_base_entries, list):
         return []
 
-    matched_entries = []
     normalized_query = _normalize_text_for_search(query)
 
     if not normalized_query: # Se la query normalizzata è vuota
         return []
 
-    for entry in knowledge_base_entries:
-        # Controlla la domanda principale
-        domanda_text = entry.get("domanda", "")
-        normalized_domanda = _normalize_text_for_search(domanda_text)
+    return _search_exact_normalized(normalized_query, knowledge_base_entries)
 
-        if normalized_domanda == normalized_query:
-            if entry not in matched_entries:
-                matched_entries.append(entry)
-
-        if entry not in matched_entries:
-            varianti = entry.get("varianti_domanda", [])
-            if isinstance(varianti, list):
-                for variante_text in varianti:
-                    normalized_variante = _normalize_text_for_search(variante_text)
-                    if normalized_variante == normalized_query:
-                        if entry not in matched_entries:
-                            matched_entries.append(entry)
-                        break
-
-    return matched_entries
+def _search_exact_normalized(normalized_query: str, knowledge_base_entries: list[dict]) -> list[dict]:
+    """Variante interna di search_exact che riceve la query già normalizzata."""
+    exact_index = _get_kb_index(knowledge_base_entries)[0]
+    return [knowledge_base_entries[idx] for idx in exact_index.get(normalized_query, ())]
 
 def search_fuzzy(query: str, knowledge_base_entries: list[dict], threshold: int = 80) -> list[tuple[dict, float]]:
     """
@@ -171,39 +475,150 @@ def search_fuzzy(query: str, knowledge_base_entries: list[dict], threshold: int
     normalized_query = _normalize_text_for_search(query)
     if not normalized_query:
         return []
-    
-    results_with_scores = []
-    for entry in knowledge_base_entries:
-        max_score_for_this_entry = 0
 
-        domanda_text = entry.get("domanda", "")
-        normalized_domanda = _normalize_text_for_search(domanda_text)
-        if normalized_domanda:
-            score = fuzz.WRatio(normalized_query, normalized_domanda)
-            if score > max_score_for_this_entry:
-                max_score_for_this_entry = score
-
-        varianti = entry.get("varianti_domanda", [])
-        if isinstance(varianti, list):
-            for variante_text in varianti:
-                normalized_variante = _normalize_text_for_search(variante_text)
-                if normalized_variante:
-                    score = fuzz.WRatio(normalized_query, normalized_variante)
-                    if score > max_score_for_this_entry:
-                        max_score_for_this_entry = score
+    return _search_fuzzy_normalized(normalized_query, knowledge_base_entries, threshold)
+
+def _search_fuzzy_normalized(normalized_query: str, knowledge_base_entries: list[dict],
+                             threshold: int) -> list[tuple[dict, float]]:
+    """Variante interna di search_fuzzy che riceve la query già normalizzata."""
+    _exact_index, flat_texts, entry_bounds, fuzzy_memo = _get_kb_index(knowledge_base_entries)
+
+    # Workload conversazionali ripetono spesso le stesse domande: i risultati
+    # fuzzy vengono memoizzati per (query, soglia) finché vive l'indice. Nel
+    # memo vivono tuple immutabili: il chiamante riceve una lista nuova, così
+    # mutarla non inquina il memo.
+    memo_key = (normalized_query, threshold)
+    cached_results = fuzzy_memo.get(memo_key)
+    if cached_results is not None:
+        return list(cached_results)
+
+    # Un'unica chiamata batch in C invece di una chiamata WRatio per testo:
+    # i punteggi sotto soglia vengono azzerati direttamente dal cutoff.
+    if flat_texts:
+        fuzz, process = _get_fuzz_modules()
+        cdist_kwargs = {}
+        if process is not _DifflibProcess:
+            # I punteggi servono solo per confronto con la soglia: uint8
+            # dimezza più volte la banda di memoria rispetto al float64 di
+            # default e il max sulla fetta resta corretto.
+            import numpy as np
+            cdist_kwargs["dtype"] = np.uint8
+            # Il DP di WRatio rilascia il GIL: su KB grandi conviene far
+            # ripartire il batch sui core fisici; sotto soglia l'overhead
+            # dei thread supererebbe il guadagno.
+            if len(flat_texts) >= 512:
+                cdist_kwargs["workers"] = -1
+        scores = process.cdist([normalized_query], flat_texts,
+                               scorer=fuzz.WRatio, score_cutoff=threshold,
+                               **cdist_kwargs)[0]
+    else:
+        scores = None
 
+    results_with_scores = []
+    for idx, (start, end) in enumerate(entry_bounds):
+        max_score_for_this_entry = float(max(scores[start:end])) if end > start else 0.0
         if max_score_for_this_entry >= threshold:
-            results_with_scores.append((entry, max_score_for_this_entry))
+            results_with_scores.append((knowledge_base_entries[idx], max_score_for_this_entry))
 
+    if len(fuzzy_memo) >= 1024: # Limite di sicurezza sulla crescita del memo
+        fuzzy_memo.clear()
+    fuzzy_memo[memo_key] = tuple(results_with_scores)
     return results_with_scores
 
-def search(query: str, file_path: str = DEFAULT_KB_PATH, fuzzy_threshold: int = 80, limit: int | None = None) -> list[tuple[dict, float]]:
+def _search_impl(normalized_query: str, file_path: str, fuzzy_threshold: int,
+                 limit: int | None) -> list[tuple[dict, float]]:
+    """Corpo di search(): riceve la query già validata e normalizzata."""
+    return _search_entries(normalized_query, load_knowledge_base(file_path),
+                           fuzzy_threshold, limit)
+
+def _search_entries(normalized_query: str, knowledge_base_entries: list[dict],
+                    fuzzy_threshold: int, limit: int | None) -> list[tuple[dict, float]]:
+    """Come _search_impl, ma su una lista di entries già caricata."""
+    if not knowledge_base_entries:
+        return []
+
+    results_with_id_map = {}
+    results_without_id_list = []
+
+    exact_match_entries = _search_exact_normalized(normalized_query, knowledge_base_entries)
+    for entry in exact_match_entries:
+        score = calculate_confidence_score(normalized_query, entry, is_exact_match=True)
+        entry_id = entry.get("id")
+        if entry_id is not None:
+            results_with_id_map[entry_id] = (entry, score)
+        else:
+            results_without_id_list.append((entry, score))
+
+    # Se i soli match esatti (tutti a punteggio 100, il massimo) bastano già a
+    # riempire il limite richiesto, nessun risultato fuzzy (<= 100) potrebbe
+    # scalzarli: si salta per intero il batch di scoring.
+    exact_hits = len(results_with_id_map) + len(results_without_id_list)
+    if isinstance(limit, int) and 0 <= limit <= exact_hits:
+        fuzzy_candidates_with_scores = []
+    else:
+        # search_fuzzy restituisce già il punteggio di confidenza (max WRatio su
+        # domanda e varianti, con soglia applicata): si riusa direttamente invece
+        # di ricalcolarlo con calculate_confidence_score per ogni candidato.
+        fuzzy_candidates_with_scores = _search_fuzzy_normalized(normalized_query, knowledge_base_entries, fuzzy_threshold)
+
+    for entry, score in fuzzy_candidates_with_scores:
+        entry_id = entry.get("id")
+        if entry_id is not None:
+            if entry_id not in results_with_id_map:
+                results_with_id_map[entry_id] = (entry, score)
+        else:
+            is_duplicate_exact_no_id = False
+            for ex_entry_no_id, _ in results_without_id_list:
+                if ex_entry_no_id is entry:
+                    is_duplicate_exact_no_id = True
+                    break
+            if not is_duplicate_exact_no_id:
+                results_without_id_list.append((entry, score))
+
+    # Nel caso comune una delle due parti è vuota: si evita di allocare la
+    # lista concatenata e si ordina direttamente quella non vuota.
+    if not results_without_id_list:
+        final_results = list(results_with_id_map.values())
+    elif not results_with_id_map:
+        final_results = results_without_id_list
+    else:
+        final_results = list(results_with_id_map.values()) + results_without_id_list
+
+    if isinstance(limit, int):
+        if limit == 0:
+            return []
+        # Selezione parziale: con un limite piccolo rispetto ai risultati,
+        # heapq.nlargest costa O(N log k) invece dell'ordinamento completo
+        # O(N log N) (ed è stabile come sorted(..., reverse=True)[:k]).
+        if 0 < limit < len(final_results) // 2:
+            return heapq.nlargest(limit, final_results, key=lambda x: x[1])
+
+    final_results.sort(key=lambda x: x[1], reverse=True)
+
+    if isinstance(limit, int) and limit > 0:
+        return final_results[:limit]
+
+    return final_results
+
+@functools.lru_cache(maxsize=1024)
+def _search_cached(normalized_query: str, file_path: str, _kb_stamp: tuple[int, int],
+                   fuzzy_threshold: int, limit: int | None) -> tuple[tuple[dict, float], ...]:
+    """Memoizza _search_impl; _kb_stamp (mtime, dimensione) fa parte della chiave
+    così le voci in cache decadono da sole quando il file della KB cambia.
+    Il valore in cache è una tupla immutabile: il chiamante riceve sempre una
+    lista nuova, così mutarla non inquina la cache."""
+    return tuple(_search_impl(normalized_query, file_path, fuzzy_threshold, limit))
+
+def search(query: str, file_path: str = DEFAULT_KB_PATH, fuzzy_threshold: int = 80,
+           limit: int | None = None, entries: list[dict] | None = None) -> list[tuple[dict, float]]:
     """
     Funzione di alto livello per eseguire una ricerca nella knowledge base.
     Combina risultati da ricerca esatta e fuzzy, calcolando un punteggio di confidenza
     per ciascun risultato usando calculate_confidence_score.
     Gestisce i duplicati dando priorità ai match esatti.
     Ordina i risultati per punteggio (decrescente) e applica un limite opzionale.
+    Le ricerche ripetute con gli stessi parametri vengono servite da una cache LRU
+    legata allo stato (mtime/dimensione) del file della knowledge base.
 
     Args:
         query (str): La stringa di ricerca.
@@ -216,55 +631,34 @@ def search(query: str, file_path: str = DEFAULT_KB_PATH, fuzzy_threshold: int =
                                       Se None o un intero non valido (es. negativo),
                                       vengono restituiti tutti i risultati.
                                       Se 0, restituisce una lista vuota. Default a None.
+        entries (list[dict] | None, optional): Lista di entries già caricata su
+                                      cui cercare direttamente: se fornita,
+                                      file_path viene ignorato e non c'è alcun
+                                      I/O né memoizzazione su file. Default a None.
     Returns:
         list[tuple[dict, float]]: Una lista di tuple (entry, score) ordinate ed eventualmente limitate.
                                   Restituisce una lista vuota se non ci sono corrispondenze
                                   o in caso di errore nel caricamento della KB.
     """
-    knowledge_base_entries = load_knowledge_base(file_path)
-    if not knowledge_base_entries:
+    if not query or not isinstance(query, str):
         return []
 
-    results_with_id_map = {}
-    results_without_id_list = []
-
-    exact_match_entries = search_exact(query, knowledge_base_entries)
-    for entry in exact_match_entries:
-        score = calculate_confidence_score(query, entry, is_exact_match=True)
-        entry_id = entry.get("id")
-        if entry_id is not None:
-            results_with_id_map[entry_id] = (entry, score)
-        else:
-            results_without_id_list.append((entry, score))
-
-    fuzzy_candidates_with_internal_scores = search_fuzzy(query, knowledge_base_entries, threshold=fuzzy_threshold)
-
-    for entry, _ in fuzzy_candidates_with_internal_scores:
-        entry_id = entry.get("id")
-        if entry_id is not None:
-            if entry_id in results_with_id_map:
-                continue
-            score = calculate_confidence_score(query, entry, is_exact_match=False)
-            if score >= fuzzy_threshold:
-                results_with_id_map[entry_id] = (entry, score)
-        else:
-            score = calculate_confidence_score(query, entry, is_exact_match=False)
-            if score >= fuzzy_threshold:
-                is_duplicate_exact_no_id = False
-                for ex_entry_no_id, _ in results_without_id_list:
-                    if ex_entry_no_id is entry:
-                        is_duplicate_exact_no_id = True
-                        break
-                if not is_duplicate_exact_no_id:
-                    results_without_id_list.append((entry, score))
-
-    final_results = list(results_with_id_map.values()) + results_without_id_list
-    final_results.sort(key=lambda x: x[1], reverse=True)
-
-    if isinstance(limit, int):
-        if limit == 0:
-            return []
-        if limit > 0:
-            return final_results[:limit]
+    # La query viene normalizzata una sola volta e riusata da tutti i passaggi.
+    normalized_query = _normalize_text_for_search(query)
+    if not normalized_query:
+        return []
 
-    return final_results
+    limit_key = limit if isinstance(limit, int) else None
+    if entries is not None:
+        # KB iniettata in memoria: si salta caricamento e cache su file (gli
+        # indici derivati restano comunque memoizzati sull'identità della lista).
+        return _search_entries(normalized_query, entries, fuzzy_threshold, limit_key)
+    try:
+        file_stat = os.stat(file_path)
+        kb_stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+    except OSError:
+        # Senza uno stato del file affidabile non si può invalidare la cache:
+        # si esegue la ricerca senza memoizzazione.
+        return _search_impl(normalized_query, file_path, fuzzy_threshold, limit_key)
+
+    return list(_search_cached(normalized_query, file_path, kb_stamp, fuzzy_threshold, limit_key))
@@ -1,3 +1,4 @@
+import io
 import json
 import os
 import pytest
@@ -46,14 +47,16 @@ def create_test_kb_file(tmp_path_factory):
     VALID_KB_PATH = str(kb_path)
     return str(kb_path)
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def sample_kb():
-    """Fornisce i dati della KB come oggetto Python."""
+    """Fornisce i dati della KB come oggetto Python (sola lettura, quindi
+    costruiti una volta per modulo invece che per ogni test)."""
     return SAMPLE_KB_DATA["entries"]
 
-@pytest.fixture
-def sample_kb_for_fuzzy(tmp_path):
-    """Crea una KB specifica per i test di fuzzy matching."""
+@pytest.fixture(scope="module")
+def sample_kb_for_fuzzy(tmp_path_factory):
+    """Crea una KB specifica per i test di fuzzy matching (sola lettura,
+    condivisa a livello di modulo)."""
     kb_data = {
         "entries": [
             {"id": 101, "domanda": "Cos'è l'intelligenza artificiale?", "varianti_domanda": ["Definizione IA"], "risposta": "Risposta IA"},
@@ -61,7 +64,7 @@ def sample_kb_for_fuzzy(tmp_path):
             {"id": 103, "domanda": "Test Driven Development", "varianti_domanda": ["TDD"], "risposta": "Risposta TDD"}
         ]
     }
-    fuzzy_kb_file = tmp_path / "fuzzy_kb.json"
+    fuzzy_kb_file = tmp_path_factory.mktemp("data") / "fuzzy_kb.json"
     with open(fuzzy_kb_file, 'w', encoding='utf-8') as f:
         json.dump(kb_data, f)
     return kb_data["entries"]
@@ -86,6 +89,23 @@ def test_load_knowledge_base_invalid_json(tmp_path):
     entries = load_knowledge_base(str(invalid_json_file))
     assert entries == []
 
+def test_load_knowledge_base_from_file_like():
+    """Verifica il caricamento da un oggetto file-like in memoria (io.BytesIO)."""
+    buffer = io.BytesIO(json.dumps(SAMPLE_KB_DATA).encode('utf-8'))
+    entries = load_knowledge_base(buffer)
+    assert len(entries) == 3
+    assert entries[0]["id"] == 1
+
+def test_load_knowledge_base_jsonl(tmp_path):
+    """Verifica il caricamento di una KB in formato JSON Lines (una voce per riga)."""
+    jsonl_file = tmp_path / "kb.jsonl"
+    with open(jsonl_file, 'w', encoding='utf-8') as f:
+        for entry in SAMPLE_KB_DATA["entries"]:
+            f.write(json.dumps(entry) + "\n")
+    entries = load_knowledge_base(str(jsonl_file))
+    assert len(entries) == 3
+    assert entries[1]["id"] == 2
+
 # Test per search_exact
 def test_search_exact_match_in_domanda(sample_kb):
     results = search_exact("Cos'è Python?", sample_kb)
@@ -157,6 +177,20 @@ def test_search_combines_exact_and_fuzzy_correctly(tmp_path, sample_kb_for_fuzzy
     assert entry_ia["id"] == 101
     assert 80.0 <= score_ia < 100.0
 
+def test_search_with_injected_entries(sample_kb):
+    """Verifica che search accetti una KB già caricata via entries=, senza I/O."""
+    results = search("Cos'è Python?", entries=sample_kb)
+    assert len(results) >= 1
+    entry, score = results[0]
+    assert entry["id"] == 2
+    assert score == 100.0
+
+def test_search_with_injected_entries_fuzzy(sample_kb_for_fuzzy):
+    """Verifica che il percorso fuzzy funzioni anche con la KB iniettata."""
+    results = search("machine learnin", entries=sample_kb_for_fuzzy, fuzzy_threshold=80)
+    assert len(results) == 1
+    assert results[0][0]["id"] == 102
+
 # Test per calculate_confidence_score
 class TestCalculateConfidenceScore:
     def test_exact_match_returns_100(self):